@@ -15,7 +15,8 @@ answer_llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
 # State
 class AgentState(TypedDict, total=False):
     messages: Annotated[List[BaseMessage], add_messages]
-    route: Literal["rag", "answer", "end"]
+    route: Literal["rag", "both", "answer", "end"]
+    query: str
     rag: str
     web: str
 
@@ -32,13 +33,13 @@ def router_node(state: AgentState) -> AgentState:
         ("user", query)
     ]
     result: RouteDecision = router_llm.invoke(messages)
-    out = {"messages": state["messages"], "route": result.route}
+    out = {"messages": state["messages"], "route": result.route, "query": query}
     if result.route == "end":
         out["messages"] = state["messages"] + [AIMessage(content=result.reply or "Hello!")]
     return out
 
 def rag_node(state: AgentState) -> AgentState:
-    query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+    query = state["query"]
     chunks = rag_search_tool.invoke({"query": query})
     judge_messages = [
         ("system", (
@@ -51,12 +52,12 @@ def rag_node(state: AgentState) -> AgentState:
     return {**state, "rag": chunks, "route": "answer" if verdict.sufficient else "web"}
 
 def web_node(state: AgentState) -> AgentState:
-    query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+    query = state["query"]
     snippets = web_search_tool.invoke({"query": query})
     return {**state, "web": snippets, "route": "answer"}
 
 def answer_node(state: AgentState) -> AgentState:
-    user_q = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+    user_q = state["query"]
     ctx_parts = []
     if state.get("rag"):
         ctx_parts.append("Knowledge Base Information:\n" + state["rag"])
@@ -75,7 +76,7 @@ Provide a helpful, accurate, and concise response based on the available informa
     return {**state, "messages": state["messages"] + [AIMessage(content=ans)]}
 
 # Routing helpers
-def from_router(st: AgentState) -> Literal["rag", "answer", "end"]:
+def from_router(st: AgentState) -> Literal["rag", "both", "answer", "end"]:
     return st["route"]
 
 def after_rag(st: AgentState) -> Literal["answer", "web"]:
@@ -92,7 +93,7 @@ def get_agent():
     g.add_node("web_search", web_node)
     g.add_node("answer", answer_node)
     g.set_entry_point("router")
-    g.add_conditional_edges("router", from_router, {"rag": "rag_lookup", "answer": "answer", "end": END})
+    g.add_conditional_edges("router", from_router, {"rag": "rag_lookup", "both": "rag_lookup", "answer": "answer", "end": END})
     g.add_conditional_edges("rag_lookup", after_rag, {"answer": "answer", "web": "web_search"})
     g.add_edge("web_search", "answer")
     g.add_edge("answer", END)
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB = "checkpoints.db"
+THREAD_TTL_SECONDS = 24 * 60 * 60
+MAX_THREADS = 10_000
+PRUNE_INTERVAL_SECONDS = 10 * 60
+
+async def open_checkpointer(path: str = CHECKPOINT_DB) -> AsyncSqliteSaver:
+    """Open the SQLite checkpointer (WAL mode) and the thread activity table used for pruning"""
+    conn = await aiosqlite.connect(path)
+    saver = AsyncSqliteSaver(conn)
+    await saver.setup()
+    async with saver.lock:
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity ("
+            "thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        await conn.commit()
+    return saver
+
+async def touch_thread(saver: AsyncSqliteSaver, thread_id: str) -> None:
+    """Record that a thread was just used"""
+    async with saver.lock:
+        await saver.conn.execute(
+            "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (thread_id, time.time()),
+        )
+        await saver.conn.commit()
+
+async def prune_threads(saver: AsyncSqliteSaver, ttl_seconds: float = THREAD_TTL_SECONDS,
+                        max_threads: int = MAX_THREADS) -> int:
+    """Delete threads idle for longer than the TTL, then the least recently used beyond max_threads"""
+    async with saver.lock:
+        cursor = await saver.conn.execute(
+            "SELECT thread_id FROM thread_activity WHERE updated_at < ? "
+            "UNION SELECT thread_id FROM ("
+            "SELECT thread_id FROM thread_activity ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (time.time() - ttl_seconds, max_threads),
+        )
+        stale = [row[0] for row in await cursor.fetchall()]
+    for thread_id in stale:
+        await saver.adelete_thread(thread_id)
+        async with saver.lock:
+            await saver.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+            await saver.conn.commit()
+    return len(stale)
+
+async def prune_periodically(saver: AsyncSqliteSaver, interval_seconds: float = PRUNE_INTERVAL_SECONDS) -> None:
+    """Background task that prunes stale threads every interval"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            pruned = await prune_threads(saver)
+            if pruned:
+                logger.info(f"Pruned {pruned} stale conversation threads")
+        except Exception as e:
+            logger.warning(f"Failed to prune checkpoints: {e}")
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import re
+from typing import List, Optional, Tuple
+import numpy as np
+import tiktoken
+from app.vector_store import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = 1500
+DUPLICATE_SIMILARITY = 0.85
+# Gemini's tokenizer is not public; cl100k is a close enough budget estimate
+TOKEN_ENCODING = "cl100k_base"
+# tiktoken downloads the encoding on first use; give up on it after this long
+ENCODING_LOAD_TIMEOUT = 10
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+# Web results are formatted as "Title: ...\nContent: ...\nURL: ..." blocks separated by blank lines
+_WEB_RESULT_BOUNDARY = re.compile(r"\n\s*\n(?=Title: )")
+_encoding_task: Optional[asyncio.Task] = None
+
+async def _load_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(tiktoken.get_encoding, TOKEN_ENCODING), ENCODING_LOAD_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Token encoding unavailable, estimating 4 characters per token: {e}")
+        return None
+
+async def _get_encoding() -> Optional[tiktoken.Encoding]:
+    """Load the encoding once off the event loop; a failed load is remembered, not retried"""
+    global _encoding_task
+    if _encoding_task is None:
+        _encoding_task = asyncio.ensure_future(_load_encoding())
+    return await asyncio.shield(_encoding_task)
+
+def _count_tokens(text: str, encoding: Optional[tiktoken.Encoding]) -> int:
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def _split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(text or "") if s.strip()]
+
+def _split_web_results(text: str) -> List[str]:
+    return [r.strip() for r in _WEB_RESULT_BOUNDARY.split(text or "") if r.strip()]
+
+async def compress_context(query: str, rag: str, web: str,
+                           budget_tokens: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, str]:
+    """Deduplicate RAG and web context and trim it to a token budget.
+
+    RAG context is split into sentences and web context into whole results,
+    so a result's title, content and URL stay together. Exact duplicate
+    passages are dropped first. If the rest still exceeds the budget, passages
+    are embedded, ranked by similarity to the query, and kept greedily unless
+    they are within DUPLICATE_SIMILARITY of a passage already kept. Surviving
+    passages keep their original order within each source.
+    """
+    passages: List[Tuple[str, str]] = []
+    seen = set()
+    for source, split in (("rag", _split_sentences(rag)), ("web", _split_web_results(web))):
+        for passage in split:
+            key = " ".join(passage.lower().split())
+            if key not in seen:
+                seen.add(key)
+                passages.append((source, passage))
+    encoding = await _get_encoding()
+    costs = [_count_tokens(p, encoding) for _, p in passages]
+
+    if sum(costs) <= budget_tokens:
+        keep = range(len(passages))
+    else:
+        try:
+            embeddings = get_embeddings()
+            vectors = np.asarray(await embeddings.aembed_documents_uncached([p for _, p in passages]), dtype=np.float32)
+            q = np.asarray(await embeddings.aembed_query(query), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            q /= max(float(np.linalg.norm(q)), 1e-12)
+            order = np.argsort(-(vectors @ q))
+        except Exception as e:
+            logger.warning(f"Semantic context filtering unavailable: {e}")
+            vectors, order = None, range(len(passages))
+        keep, used = [], 0
+        for i in order:
+            if used + costs[i] > budget_tokens:
+                continue
+            if vectors is not None and keep and float(np.max(vectors[keep] @ vectors[i])) > DUPLICATE_SIMILARITY:
+                continue
+            keep.append(int(i))
+            used += costs[i]
+        keep = sorted(keep)
+
+    kept = [passages[i] for i in keep]
+    return (
+        "\n".join(p for source, p in kept if source == "rag"),
+        "\n\n".join(p for source, p in kept if source == "web"),
+    )
@@ -1,111 +1,151 @@
+import asyncio
+import logging
 from typing import Annotated, TypedDict, List, Literal
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_google_genai import ChatGoogleGenerativeAI
-from app.schemas import RouteDecision, RagJudge
-from app.tools import rag_search_tool, web_search_tool
+from app.schemas import RouteDecision
+from app.tools import rag_search_tool, web_search_tool, search_knowledge_base
+from app.context_filter import compress_context
+from app.reranker import RELEVANCE_THRESHOLD, ascore
 from app.config import validate_api_keys
 
+logger = logging.getLogger(__name__)
+
 # Validate API keys before initializing models
 validate_api_keys()
 
+# Cosine similarity of the best vector match above which the reranker is skipped
+CONFIDENT_RELEVANCE = 0.8
+
 # LLM instances using Gemini models
 router_llm = ChatGoogleGenerativeAI(
     model="gemini-2.5-flash", 
-    temperature=0,
-    convert_system_message_to_human=True
+    temperature=0
 ).with_structured_output(RouteDecision)
 
-judge_llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", 
-    temperature=0,
-    convert_system_message_to_human=True
-).with_structured_output(RagJudge)
-
 answer_llm = ChatGoogleGenerativeAI(
     model="gemini-2.5-flash", 
-    temperature=0.7,
-    convert_system_message_to_human=True
+    temperature=0.7
 )
 
+# Prompts; Gemini receives the system messages as its native system_instruction
+ROUTER_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template((
+        "You are a router that decides how to handle user queries:\n"
+        "- Use 'end' for pure greetings/small-talk (also provide a 'reply')\n"
+        "- Use 'rag' when knowledge base lookup is needed\n"
+        "- Use 'both' when the query needs the knowledge base and up-to-date web info\n"
+        "- Use 'answer' when you can answer directly without external info\n\n"
+        "Respond with the appropriate route and reply if needed."
+    )),
+    HumanMessagePromptTemplate.from_template("{query}"),
+])
+
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template((
+        "Please answer the user's question using the provided context. "
+        "Provide a helpful, accurate, and concise response based on the available information."
+    )),
+    HumanMessagePromptTemplate.from_template("Question: {user_q}\n\nContext:\n{context}"),
+])
+
+# Chains
+router_chain = ROUTER_PROMPT | router_llm
+
+# Streamed in the node's own context so its tokens reach astream_events
+answer_chain = ANSWER_PROMPT | answer_llm
+
 # State
 class AgentState(TypedDict, total=False):
     messages: Annotated[List[BaseMessage], add_messages]
-    route: Literal["rag", "answer", "end"]
+    route: Literal["rag", "both", "answer", "end"]
+    query: str
     rag: str
     web: str
 
+def _last_human(state: AgentState) -> str:
+    return next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+
+def _tool_context(result: str, error_prefix: str, source: str) -> str:
+    """Tool output to use as context; failures reported as '<PREFIX>::...' strings are logged and dropped"""
+    if result.startswith(error_prefix):
+        logger.warning(f"{source} failed: {result[len(error_prefix):]}")
+        return ""
+    return result
+
 # Nodes
-def router_node(state: AgentState) -> AgentState:
+async def router_node(state: AgentState) -> AgentState:
     """Route user query to appropriate processing path"""
-    query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
-    
-    # For Gemini, we need to convert system messages to human messages
-    prompt = (
-        "You are a router that decides how to handle user queries:\n"
-        "- Use 'end' for pure greetings/small-talk (also provide a 'reply')\n"
-        "- Use 'rag' when knowledge base lookup is needed\n"
-        "- Use 'answer' when you can answer directly without external info\n\n"
-        f"User query: {query}\n\n"
-        "Respond with the appropriate route and reply if needed."
-    )
-    
-    result: RouteDecision = router_llm.invoke([HumanMessage(content=prompt)])
-    out = {"messages": state["messages"], "route": result.route}
+    query = _last_human(state)
+    result: RouteDecision = await router_chain.ainvoke({"query": query})
+    out = {"messages": state["messages"], "route": result.route, "query": query}
     if result.route == "end":
         out["messages"] = state["messages"] + [AIMessage(content=result.reply or "Hello!")]
     return out
 
-def rag_node(state: AgentState) -> AgentState:
+async def rag_node(state: AgentState) -> AgentState:
     """Retrieve documents from knowledge base and judge sufficiency"""
-    query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
-    chunks = rag_search_tool.invoke({"query": query})
-    
-    judge_prompt = (
-        "You are a judge evaluating if the retrieved information is sufficient "
-        "to answer the user's question. Consider both relevance and completeness.\n\n"
-        f"Question: {query}\n\n"
-        f"Retrieved info: {chunks}\n\n"
-        "Is this sufficient to answer the question? Respond with true for sufficient, false for insufficient."
-    )
+    query = state["query"]
+    try:
+        chunks, best_score = await asyncio.to_thread(search_knowledge_base, query)
+    except Exception as e:
+        logger.warning(f"Knowledge base search failed: {e}")
+        return {**state, "rag": "", "route": "web"}
+    if not chunks:
+        return {**state, "rag": "", "route": "web"}
     
-    verdict: RagJudge = judge_llm.invoke([HumanMessage(content=judge_prompt)])
-    return {**state, "rag": chunks, "route": "answer" if verdict.sufficient else "web"}
-
-def web_node(state: AgentState) -> AgentState:
+    # A close vector match is trusted as is; otherwise ask the cross-encoder
+    sufficient = best_score > CONFIDENT_RELEVANCE
+    if not sufficient:
+        scores = await ascore(query, chunks)
+        sufficient = max(scores) > RELEVANCE_THRESHOLD
+    return {**state, "rag": "\n\n".join(chunks), "route": "answer" if sufficient else "web"}
+
+async def web_node(state: AgentState) -> AgentState:
     """Perform web search for additional information"""
-    query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
-    snippets = web_search_tool.invoke({"query": query})
-    return {**state, "web": snippets, "route": "answer"}
-
-def answer_node(state: AgentState) -> AgentState:
+    query = state["query"]
+    snippets = await web_search_tool.ainvoke({"query": query})
+    return {**state, "web": _tool_context(snippets, "WEB_ERROR::", "Web search"), "route": "answer"}
+
+async def retrieve_node(state: AgentState) -> AgentState:
+    """Query the knowledge base and the web concurrently"""
+    query = state["query"]
+    chunks, snippets = await asyncio.gather(
+        rag_search_tool.ainvoke({"query": query}),
+        web_search_tool.ainvoke({"query": query}),
+    )
+    return {
+        **state,
+        "rag": _tool_context(chunks, "RAG_ERROR::", "Knowledge base search"),
+        "web": _tool_context(snippets, "WEB_ERROR::", "Web search"),
+        "route": "answer",
+    }
+
+async def answer_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """Generate final answer using available context"""
-    user_q = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+    user_q = state["query"]
+    rag, web = await compress_context(user_q, state.get("rag", ""), state.get("web", ""))
     ctx_parts = []
     
-    if state.get("rag"):
-        ctx_parts.append("Knowledge Base Information:\n" + state["rag"])
-    if state.get("web"):
-        ctx_parts.append("Web Search Results:\n" + state["web"])
+    if rag:
+        ctx_parts.append("Knowledge Base Information:\n" + rag)
+    if web:
+        ctx_parts.append("Web Search Results:\n" + web)
     
     context = "\n\n".join(ctx_parts) if ctx_parts else "No external context available."
-    
-    prompt = f"""Please answer the user's question using the provided context.
-
-Question: {user_q}
-
-Context:
-{context}
-
-Provide a helpful, accurate, and concise response based on the available information."""
-    
-    ans = answer_llm.invoke([HumanMessage(content=prompt)]).content
+    tokens = []
+    async for chunk in answer_chain.astream({"user_q": user_q, "context": context}, config):
+        tokens.append(chunk.content)
+    ans = "".join(tokens)
     return {**state, "messages": state["messages"] + [AIMessage(content=ans)]}
 
 # Routing helpers
-def from_router(st: AgentState) -> Literal["rag", "answer", "end"]:
+def from_router(st: AgentState) -> Literal["rag", "both", "answer", "end"]:
     return st["route"]
 
 def after_rag(st: AgentState) -> Literal["answer", "web"]:
@@ -115,16 +155,21 @@ def after_web(_) -> Literal["answer"]:
     return "answer"
 
 # Graph
-def get_gemini_agent():
-    """Create and compile the Gemini-based RAG agent"""
+def _build_graph() -> StateGraph:
     g = StateGraph(AgentState)
     g.add_node("router", router_node)
     g.add_node("rag_lookup", rag_node)
     g.add_node("web_search", web_node)
+    g.add_node("retrieve", retrieve_node)
     g.add_node("answer", answer_node)
     g.set_entry_point("router")
-    g.add_conditional_edges("router", from_router, {"rag": "rag_lookup", "answer": "answer", "end": END})
+    g.add_conditional_edges("router", from_router, {"rag": "rag_lookup", "both": "retrieve", "answer": "answer", "end": END})
     g.add_conditional_edges("rag_lookup", after_rag, {"answer": "answer", "web": "web_search"})
     g.add_edge("web_search", "answer")
+    g.add_edge("retrieve", "answer")
     g.add_edge("answer", END)
-    return g.compile(checkpointer=MemorySaver())
\ No newline at end of file
+    return g
+
+def get_gemini_agent(checkpointer=None):
+    """Create and compile the Gemini-based RAG agent (in-memory checkpoints unless a checkpointer is given)"""
+    return _build_graph().compile(checkpointer=checkpointer or MemorySaver())
\ No newline at end of file
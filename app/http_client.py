@@ -0,0 +1,23 @@
+import httpx
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+_HTTP = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared HTTP/2 client so outbound API calls reuse pooled TLS connections"""
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+            timeout=httpx.Timeout(30.0),
+        )
+    return _HTTP
+
+async def close_http_client() -> None:
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
@@ -0,0 +1,29 @@
+import asyncio
+import threading
+from typing import List
+from sentence_transformers import CrossEncoder
+
+RERANK_MODEL = "BAAI/bge-reranker-base"
+# Scores are sigmoid-activated relevance in [0, 1]
+RELEVANCE_THRESHOLD = 0.5
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_reranker() -> CrossEncoder:
+    """Load the cross-encoder once and keep it pinned in memory"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = CrossEncoder(RERANK_MODEL)
+    return _model
+
+def score(query: str, passages: List[str]) -> List[float]:
+    """Relevance of each passage to the query"""
+    if not passages:
+        return []
+    return get_reranker().predict([(query, p) for p in passages]).tolist()
+
+async def ascore(query: str, passages: List[str]) -> List[float]:
+    # CPU-bound inference; keep it off the event loop
+    return await asyncio.to_thread(score, query, passages)
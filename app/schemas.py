@@ -9,7 +9,7 @@ class PersonInfo(BaseModel):
     skills: List[str] = Field(description="List of skills or expertise")
 
 class RouteDecision(BaseModel):
-    route: Literal["rag", "answer", "end"]
+    route: Literal["rag", "both", "answer", "end"]
     reply: str | None = Field(None, description="Filled only when route == 'end'")
 
 class RagJudge(BaseModel):
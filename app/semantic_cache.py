@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+import numpy as np
+from app.vector_store import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 10_000
+TTL_SECONDS = 60 * 60
+PCA_COMPONENTS = 128
+PCA_FIT_SIZE = 1000
+# Rows shortlisted by the int8 scores and re-scored with exact cosine
+RESCORE_CANDIDATES = 8
+_INITIAL_CAPACITY = 256
+
+@dataclass
+class CacheEntry:
+    query: str
+    answer: str
+    created_at: float
+
+class SemanticCache:
+    """In-memory cache of final answers keyed by query embedding.
+
+    Embeddings are L2-normalised on insert so cosine similarity against every
+    cached query is a single matrix-vector product. Entries live in fixed rows
+    of that matrix; an OrderedDict of row -> entry tracks LRU order.
+
+    Once ``PCA_FIT_SIZE`` entries are cached, a background task fits the top
+    ``PCA_COMPONENTS`` right singular vectors in a worker thread. Rows are then
+    also kept as re-normalised projections quantised to int8; lookups rank all
+    rows by the int32-accumulated int8 dot product, re-score the best
+    ``RESCORE_CANDIDATES`` against the full vectors, and apply the threshold to
+    that exact cosine.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_ENTRIES, ttl_seconds: float = TTL_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._vectors: Optional[np.ndarray] = None
+        self._codes: Optional[np.ndarray] = None
+        self._active = np.zeros(0, dtype=bool)
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._free: List[int] = []
+        self._components: Optional[np.ndarray] = None
+        self._scale = 1.0
+        self._fit_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def embed(self, query: str) -> np.ndarray:
+        """Embed a query with the same model used for the knowledge base"""
+        return self._normalize(await get_embeddings().aembed_query(query))
+
+    def lookup(self, embedding: np.ndarray) -> Optional[CacheEntry]:
+        """Return the closest cached entry if it is similar and fresh enough"""
+        if not self._entries:
+            self.misses += 1
+            return None
+        if self._codes is None:
+            sims = self._vectors @ embedding
+            sims[~self._active] = -np.inf
+            row = int(np.argmax(sims))
+            similarity = sims[row]
+        else:
+            approx = np.matmul(self._codes, self._encode(embedding), dtype=np.int32)
+            approx[~self._active] = np.iinfo(np.int32).min
+            k = min(RESCORE_CANDIDATES, len(approx))
+            candidates = np.argpartition(approx, -k)[-k:]
+            candidates = candidates[self._active[candidates]]
+            sims = self._vectors[candidates] @ embedding
+            best = int(np.argmax(sims))
+            row, similarity = int(candidates[best]), sims[best]
+        if similarity < self.threshold:
+            self.misses += 1
+            return None
+        entry = self._entries[row]
+        if time.time() - entry.created_at > self.ttl_seconds:
+            self._evict(row)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(row)
+        self.hits += 1
+        return entry
+
+    def store(self, embedding: np.ndarray, query: str, answer: str) -> None:
+        """Cache an answer, evicting the least recently used entry when full"""
+        if self._vectors is None:
+            self._vectors = np.zeros((min(_INITIAL_CAPACITY, self.max_entries), embedding.shape[0]), dtype=np.float32)
+            self._active = np.zeros(self._vectors.shape[0], dtype=bool)
+            self._free = list(range(self._vectors.shape[0] - 1, -1, -1))
+        if not self._free:
+            if len(self._entries) >= self.max_entries:
+                self._evict(next(iter(self._entries)))
+            else:
+                self._grow()
+        row = self._free.pop()
+        self._vectors[row] = embedding
+        if self._codes is not None:
+            self._codes[row] = self._encode(embedding)
+        self._active[row] = True
+        self._entries[row] = CacheEntry(query=query, answer=answer, created_at=time.time())
+        if self._fit_task is None and len(self._entries) >= PCA_FIT_SIZE:
+            self._fit_task = asyncio.get_running_loop().create_task(self._fit_projection())
+
+    def _evict(self, row: int) -> None:
+        del self._entries[row]
+        self._active[row] = False
+        self._free.append(row)
+
+    def _grow(self) -> None:
+        old = self._vectors.shape[0]
+        new = min(old * 2, self.max_entries)
+        self._vectors = np.vstack([self._vectors, np.zeros((new - old, self._vectors.shape[1]), dtype=self._vectors.dtype)])
+        if self._codes is not None:
+            self._codes = np.vstack([self._codes, np.zeros((new - old, self._codes.shape[1]), dtype=self._codes.dtype)])
+        self._active = np.concatenate([self._active, np.zeros(new - old, dtype=bool)])
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    async def _fit_projection(self) -> None:
+        """Fit PCA_COMPONENTS dims off the event loop, then quantise every row's projection to int8"""
+        try:
+            components = await asyncio.to_thread(self._principal_components, self._vectors[self._active])
+        except Exception as e:
+            logger.warning(f"Semantic cache projection fit failed: {e}")
+            self._fit_task = None
+            return
+        self._components = components
+        projected = self._project(self._vectors)
+        self._scale = 127.0 / float(np.abs(projected[self._active]).max())
+        self._codes = self._quantize(projected)
+
+    @staticmethod
+    def _principal_components(sample: np.ndarray) -> np.ndarray:
+        n_components = min(PCA_COMPONENTS, *sample.shape)
+        _, _, vt = np.linalg.svd(sample, full_matrices=False)
+        return vt[:n_components].T.astype(np.float32)
+
+    def _encode(self, embedding: np.ndarray) -> np.ndarray:
+        return self._quantize(self._project(embedding))
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        projected = vectors @ self._components
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.where(norms > 0, norms, 1.0)
+
+    def _quantize(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors * self._scale), -127, 127).astype(np.int8)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+semantic_cache = SemanticCache()
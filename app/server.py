@@ -3,11 +3,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional, AsyncGenerator
+from contextlib import asynccontextmanager
 import json
 import uuid
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from app.gemini_agent import get_gemini_agent
 from app.config import validate_api_keys
+from app.semantic_cache import semantic_cache
+from app.vector_store import get_retriever
+from app.checkpoints import open_checkpointer, touch_thread, prune_periodically
+from app.http_client import close_http_client
 import asyncio
 import logging
 
@@ -40,26 +45,127 @@ class ChatRequest(BaseModel):
     messages: List[MessageInput]
     config: Optional[Dict[str, Any]] = None
 
-# Global agent instance
+# Global agent instance and its checkpoint store
 agent = None
+checkpointer = None
+prune_task = None
+
+# Bound concurrent graph runs so bursts queue here instead of fanning out to Gemini/Tavily
+MAX_CONCURRENT_REQUESTS = 16
+_SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+_waiting = 0
+_in_flight = 0
+
+@asynccontextmanager
+async def _request_slot():
+    """Hold one of the MAX_CONCURRENT_REQUESTS slots, waiting in FIFO order for a free one"""
+    global _waiting, _in_flight
+    _waiting += 1
+    try:
+        await _SEM.acquire()
+    finally:
+        _waiting -= 1
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        _SEM.release()
+
+async def _cacheable_query(messages: List[BaseMessage], config: Dict[str, Any]) -> str:
+    """The question to key the semantic cache on, or "" if it may depend on earlier turns"""
+    if len(messages) != 1 or not isinstance(messages[0], HumanMessage):
+        return ""
+    try:
+        snapshot = await agent.aget_state(config)
+    except Exception as e:
+        logger.warning(f"Failed to read thread state: {e}")
+        return ""
+    return "" if snapshot.values.get("messages") else messages[0].content
+
+async def _cache_lookup(query: str):
+    """Embed the query and look it up in the semantic cache; (None, None) if unavailable"""
+    if not query:
+        return None, None
+    try:
+        embedding = await semantic_cache.embed(query)
+    except Exception as e:
+        logger.warning(f"Semantic cache unavailable: {e}")
+        return None, None
+    return embedding, semantic_cache.lookup(embedding)
+
+def _cache_store(embedding, query: str, result: Dict[str, Any]) -> None:
+    """Cache the final AI message of a graph run under the query embedding"""
+    messages = result.get("messages", [])
+    if embedding is None or not messages or not isinstance(messages[-1], AIMessage):
+        return
+    if messages[-1].content:
+        semantic_cache.store(embedding, query, messages[-1].content)
+
+async def _touch_thread(thread_id: str) -> None:
+    """Mark a thread as active so checkpoint pruning keeps it"""
+    try:
+        await touch_thread(checkpointer, thread_id)
+    except Exception as e:
+        logger.warning(f"Failed to record thread activity: {e}")
+
+async def _record_cached_turn(config: Dict[str, Any], messages: List[BaseMessage]) -> None:
+    """Write a turn answered from the semantic cache into the thread's checkpoint"""
+    try:
+        await agent.aupdate_state(config, {"messages": messages}, as_node="answer")
+    except Exception as e:
+        logger.warning(f"Failed to record cached turn: {e}")
+    await _touch_thread(config["configurable"]["thread_id"])
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize agent on startup"""
-    global agent
+    global agent, checkpointer, prune_task
     try:
         validate_api_keys()
-        agent = get_gemini_agent()
+        checkpointer = await open_checkpointer()
+        agent = get_gemini_agent(checkpointer=checkpointer)
+        prune_task = asyncio.create_task(prune_periodically(checkpointer))
         logger.info("Gemini RAG Agent initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize agent: {e}")
         raise
+    try:
+        # Load (or build) the index once up front instead of on the first RAG query
+        await asyncio.to_thread(get_retriever)
+    except Exception as e:
+        logger.warning(f"Failed to load knowledge base index: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop checkpoint pruning and close the checkpoint database and HTTP pool"""
+    if prune_task:
+        prune_task.cancel()
+    if checkpointer:
+        await checkpointer.conn.close()
+    await close_http_client()
 
 @app.get("/")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "agent": "gemini-rag"}
 
+@app.get("/metrics")
+async def metrics():
+    """Request queue depth and semantic cache counters"""
+    return {
+        "requests": {
+            "in_flight": _in_flight,
+            "waiting": _waiting,
+            "limit": MAX_CONCURRENT_REQUESTS,
+        },
+        "semantic_cache": {
+            "entries": len(semantic_cache),
+            "hits": semantic_cache.hits,
+            "misses": semantic_cache.misses,
+        },
+    }
+
 @app.post("/invoke")
 async def invoke_agent(request: InvokeRequest):
     """Invoke the agent with input messages"""
@@ -89,11 +195,22 @@ async def invoke_agent(request: InvokeRequest):
         
         config = {"configurable": {"thread_id": thread_id}}
         
-        # Invoke agent
-        result = agent.invoke(
-            {"messages": lc_messages},
-            config=config
-        )
+        # Serve semantically duplicate opening questions without running the graph
+        query = await _cacheable_query(lc_messages, config)
+        embedding, cached = await _cache_lookup(query)
+        if cached:
+            result = {"messages": lc_messages + [AIMessage(content=cached.answer)]}
+            await _record_cached_turn(config, result["messages"])
+        else:
+            # Record activity first so pruning also covers runs that fail after checkpointing
+            await _touch_thread(thread_id)
+            # Invoke agent
+            async with _request_slot():
+                result = await agent.ainvoke(
+                    {"messages": lc_messages},
+                    config=config
+                )
+            _cache_store(embedding, query, result)
         
         # Convert response messages to dict format
         response_messages = []
@@ -143,17 +260,19 @@ async def stream_agent(request: InvokeRequest):
             
             config = {"configurable": {"thread_id": thread_id}}
             
+            await _touch_thread(thread_id)
             # Stream agent execution
-            for chunk in agent.stream(
-                {"messages": lc_messages},
-                config=config
-            ):
-                # Format chunk for streaming
-                formatted_chunk = {
-                    "event": "on_chain_stream",
-                    "data": chunk
-                }
-                yield f"data: {json.dumps(formatted_chunk)}\n\n"
+            async with _request_slot():
+                async for chunk in agent.astream(
+                    {"messages": lc_messages},
+                    config=config
+                ):
+                    # Format chunk for streaming
+                    formatted_chunk = {
+                        "event": "on_chain_stream",
+                        "data": chunk
+                    }
+                    yield f"data: {json.dumps(formatted_chunk)}\n\n"
                 
         except Exception as e:
             logger.error(f"Error streaming agent: {e}")
@@ -188,8 +307,18 @@ async def chat(request: ChatRequest):
         thread_id = request.config.get("configurable", {}).get("thread_id") if request.config else str(uuid.uuid4())
         config = {"configurable": {"thread_id": thread_id}}
         
+        # Serve semantically duplicate opening questions without running the graph
+        query = await _cacheable_query(lc_messages, config)
+        embedding, cached = await _cache_lookup(query)
+        if cached:
+            await _record_cached_turn(config, lc_messages + [AIMessage(content=cached.answer)])
+            return {"response": cached.answer, "thread_id": thread_id, "cached": True}
+        
         # Get response
-        result = agent.invoke({"messages": lc_messages}, config=config)
+        await _touch_thread(thread_id)
+        async with _request_slot():
+            result = await agent.ainvoke({"messages": lc_messages}, config=config)
+        _cache_store(embedding, query, result)
         
         # Extract last AI message
         last_message = result.get("messages", [])[-1]
@@ -203,6 +332,61 @@ async def chat(request: ChatRequest):
         logger.error(f"Error in chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Chat endpoint streaming answer tokens as server-sent events"""
+    if agent is None:
+        raise HTTPException(status_code=500, detail="Agent not initialized")
+    
+    # Convert messages to LangChain format
+    lc_messages = []
+    for msg in request.messages:
+        if msg.type == "human":
+            lc_messages.append(HumanMessage(content=msg.content))
+        elif msg.type == "ai":
+            lc_messages.append(AIMessage(content=msg.content))
+    
+    # Generate thread ID
+    thread_id = request.config.get("configurable", {}).get("thread_id") if request.config else str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    
+    async def generate_tokens():
+        try:
+            query = await _cacheable_query(lc_messages, config)
+            embedding, cached = await _cache_lookup(query)
+            if cached:
+                await _record_cached_turn(config, lc_messages + [AIMessage(content=cached.answer)])
+                yield f"data: {json.dumps({'token': cached.answer})}\n\n"
+            else:
+                streamed = False
+                result = {}
+                await _touch_thread(thread_id)
+                async with _request_slot():
+                    async for event in agent.astream_events({"messages": lc_messages}, config=config, version="v2"):
+                        if event["event"] == "on_chat_model_stream" and event["metadata"].get("langgraph_node") == "answer":
+                            token = event["data"]["chunk"].content
+                            if token:
+                                streamed = True
+                                yield f"data: {json.dumps({'token': token})}\n\n"
+                        elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+                            result = event["data"]["output"]
+                _cache_store(embedding, query, result)
+                # Router greetings are not token-streamed; cache hits are sent whole above
+                messages = result.get("messages", [])
+                if not streamed and messages and isinstance(messages[-1], AIMessage):
+                    yield f"data: {json.dumps({'token': messages[-1].content})}\n\n"
+            yield f"data: {json.dumps({'done': True, 'thread_id': thread_id})}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming chat: {e}")
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        generate_tokens(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=2024)
\ No newline at end of file
+    from start_server import LOOP
+    uvicorn.run(app, host="0.0.0.0", port=2024, loop=LOOP)
\ No newline at end of file
@@ -1,49 +1,122 @@
-from langchain_core.tools import tool
+import ast
+import operator
+from typing import List, Tuple
+import numpy as np
+from langchain_core.tools import StructuredTool, tool
 from langchain_tavily import TavilySearch
 from app.vector_store import get_retriever
 from app.config import get_tavily_api_key
+from app.http_client import get_http_client
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+MAX_EXPONENT = 1000
+# Just above the 4300-digit limit on printing ints, so anything larger could not be returned anyway
+MAX_RESULT_BITS = 15_000
+
+def _evaluate(node: ast.AST):
+    """Evaluate a parsed arithmetic expression, rejecting anything but numbers and operators"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float, complex):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        if isinstance(node.op, ast.Pow):
+            if abs(right) > MAX_EXPONENT:
+                raise ValueError(f"exponent {right} is too large")
+            if isinstance(left, int) and isinstance(right, int) and left.bit_length() * abs(right) > MAX_RESULT_BITS:
+                raise ValueError("result is too large")
+        return _OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.operand))
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
 
 @tool
 def calculator(expression: str) -> str:
     """Calculate mathematical expressions. Use this for any math calculations."""
     try:
-        result = eval(expression)
+        result = _evaluate(ast.parse(expression, mode="eval").body)
         return f"The result of {expression} is {result}"
     except Exception as e:
         return f"Error calculating {expression}: {str(e)}"
 
+TAVILY = None
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+TAVILY_MAX_RESULTS = 3
+
 def get_tavily_search():
-    """Lazy initialization of Tavily search"""
-    return TavilySearch(max_results=3, topic="general", tavily_api_key=get_tavily_api_key())
+    """Lazy initialization of a shared Tavily search client"""
+    global TAVILY
+    if TAVILY is None:
+        TAVILY = TavilySearch(max_results=TAVILY_MAX_RESULTS, topic="general", tavily_api_key=get_tavily_api_key())
+    return TAVILY
 
-@tool
-def web_search_tool(query: str) -> str:
-    """Up-to-date web info via Tavily"""
+def _format_web_results(result) -> str:
+    if isinstance(result, dict) and 'results' in result:
+        formatted_results = []
+        for item in result['results']:
+            title = item.get('title', 'No title')
+            content = item.get('content', 'No content')
+            url = item.get('url', '')
+            formatted_results.append(f"Title: {title}\nContent: {content}\nURL: {url}")
+        return "\n\n".join(formatted_results) if formatted_results else "No results found"
+    else:
+        return str(result)
+
+def _web_search(query: str) -> str:
     try:
         tavily = get_tavily_search()
-        result = tavily.invoke({"query": query})
-        if isinstance(result, dict) and 'results' in result:
-            formatted_results = []
-            for item in result['results']:
-                title = item.get('title', 'No title')
-                content = item.get('content', 'No content')
-                url = item.get('url', '')
-                formatted_results.append(f"Title: {title}\nContent: {content}\nURL: {url}")
-            return "\n\n".join(formatted_results) if formatted_results else "No results found"
-        else:
-            return str(result)
+        return _format_web_results(tavily.invoke({"query": query}))
     except Exception as e:
         return f"WEB_ERROR::{e}"
 
-@tool
-def rag_search_tool(query: str) -> str:
-    """Top-3 chunks from KB (empty string if none)"""
+async def _aweb_search(query: str) -> str:
+    # langchain_tavily opens a new aiohttp session per call, so call the REST API
+    # directly over the shared pooled HTTP/2 client instead
+    try:
+        response = await get_http_client().post(
+            TAVILY_SEARCH_URL,
+            json={"query": query, "max_results": TAVILY_MAX_RESULTS, "topic": "general"},
+            headers={"Authorization": f"Bearer {get_tavily_api_key()}"},
+        )
+        response.raise_for_status()
+        return _format_web_results(response.json())
+    except Exception as e:
+        return f"WEB_ERROR::{e}"
+
+web_search_tool = StructuredTool.from_function(
+    func=_web_search,
+    coroutine=_aweb_search,
+    name="web_search_tool",
+    description="Up-to-date web info via Tavily",
+)
+
+def search_knowledge_base(query: str) -> Tuple[List[str], float]:
+    """MMR-diverse chunks from the KB plus the cosine similarity of the best match"""
     retriever = get_retriever()
     if not retriever:
-        return "RAG_ERROR::Retriever not initialized."
+        raise RuntimeError("Retriever not initialized.")
+    store = retriever.vectorstore
+    embedding = np.asarray(store.embedding_function.embed_query(query), dtype=np.float32)
+    embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+    # MMR always selects the closest fetched chunk first, so its score is the best match
+    hits = store.max_marginal_relevance_search_with_score_by_vector(embedding, **retriever.search_kwargs)
+    return [d.page_content for d, _ in hits], max((float(score) for _, score in hits), default=0.0)
+
+@tool
+def rag_search_tool(query: str) -> str:
+    """Top chunks from KB (empty string if none)"""
     try:
-        docs = retriever.invoke(query, k=3)
-        return "\n\n".join(d.page_content for d in docs) if docs else ""
+        chunks, _ = search_knowledge_base(query)
+        return "\n\n".join(chunks)
     except Exception as e:
         return f"RAG_ERROR::{e}"
 
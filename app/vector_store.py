@@ -1,32 +1,195 @@
+import asyncio
+import functools
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import List
+from typing import List, Optional
+import diskcache
+import faiss
+import numpy as np
 from langchain_community.document_loaders import (
     PyPDFLoader, Docx2txtLoader, TextLoader, UnstructuredMarkdownLoader
 )
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Chroma
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
 import os
 
 SOURCE_DIR = Path("docs")
-INDEX_DIR = Path("chroma_db_gemini")
-COLLECTION = "kb_collection_gemini"
+INDEX_DIR = Path("faiss_index_gemini")
 EMBED_MODEL = "gemini-embedding-001"
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+MMR_SEARCH_KWARGS = {"k": 6, "fetch_k": 20, "lambda_mult": 0.5}
+# Gemini accepts up to 100 texts per batch embed request
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 8
+EMBED_CACHE_DIR = Path(".embed_cache")
+MEMORY_CACHE_SIZE = 2048
+
+_memory_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_memory_lock = threading.Lock()
+_disk_cache = None
+
+def _get_disk_cache() -> diskcache.Cache:
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = diskcache.Cache(str(EMBED_CACHE_DIR))
+    return _disk_cache
+
+class CachedEmbeddings(GoogleGenerativeAIEmbeddings):
+    """Gemini embeddings backed by an in-process LRU and a persistent disk cache.
+
+    Keys are SHA-256 digests of the model, task type, dimensionality, title and
+    text, so the query and document embeddings of the same string are cached
+    separately. Vectors are stored as float32; the async methods do their disk
+    cache I/O in a worker thread.
+    """
+
+    def _key(self, text: str, task_type: str, dims: Optional[int], title: Optional[str]) -> bytes:
+        return hashlib.sha256(f"{self.model}\0{task_type}\0{dims}\0{title}\0{text}".encode("utf-8")).digest()
+
+    def _get(self, key: bytes) -> Optional[List[float]]:
+        with _memory_lock:
+            if key in _memory_cache:
+                _memory_cache.move_to_end(key)
+                return _memory_cache[key].tolist()
+        data = _get_disk_cache().get(key)
+        if data is None:
+            return None
+        vector = np.frombuffer(data, dtype=np.float32)
+        self._remember(key, vector)
+        return vector.tolist()
+
+    def _put(self, key: bytes, vector: List[float]) -> None:
+        array = np.asarray(vector, dtype=np.float32)
+        _get_disk_cache().set(key, array.tobytes())
+        self._remember(key, array)
+
+    @staticmethod
+    def _remember(key: bytes, vector: np.ndarray) -> None:
+        with _memory_lock:
+            _memory_cache[key] = vector
+            _memory_cache.move_to_end(key)
+            if len(_memory_cache) > MEMORY_CACHE_SIZE:
+                _memory_cache.popitem(last=False)
+
+    def _query_key(self, text: str, task_type: Optional[str], kwargs) -> bytes:
+        task = task_type or self.task_type or "RETRIEVAL_QUERY"
+        return self._key(text, task, kwargs.get("output_dimensionality"), kwargs.get("title"))
+
+    def _split_documents(self, texts: List[str], task_type: Optional[str], kwargs):
+        """Return per-text keys, cached vectors (None on miss) and the first index of each missing key"""
+        task = task_type or self.task_type or "RETRIEVAL_DOCUMENT"
+        titles = kwargs.get("titles") or [None] * len(texts)
+        keys = [self._key(t, task, kwargs.get("output_dimensionality"), title) for t, title in zip(texts, titles)]
+        vectors = [self._get(k) for k in keys]
+        misses = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                misses.setdefault(keys[i], i)
+        return keys, vectors, misses
+
+    @staticmethod
+    def _miss_kwargs(kwargs, misses):
+        """kwargs for embedding only the missing texts, with their titles picked out"""
+        if not kwargs.get("titles"):
+            return kwargs
+        return {**kwargs, "titles": [kwargs["titles"][i] for i in misses.values()]}
+
+    def _stitch(self, keys, vectors, misses, fresh) -> List[List[float]]:
+        for key, vector in zip(misses, fresh):
+            self._put(key, vector)
+        return [v if v is not None else self._get(k) for k, v in zip(keys, vectors)]
+
+    def embed_query(self, text: str, task_type: Optional[str] = None, **kwargs) -> List[float]:
+        key = self._query_key(text, task_type, kwargs)
+        vector = self._get(key)
+        if vector is None:
+            vector = super().embed_query(text, task_type=task_type, **kwargs)
+            self._put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str, task_type: Optional[str] = None, **kwargs) -> List[float]:
+        key = self._query_key(text, task_type, kwargs)
+        vector = await asyncio.to_thread(self._get, key)
+        if vector is None:
+            vector = await super().aembed_query(text, task_type=task_type, **kwargs)
+            await asyncio.to_thread(self._put, key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str], task_type: Optional[str] = None, **kwargs) -> List[List[float]]:
+        keys, vectors, misses = self._split_documents(texts, task_type, kwargs)
+        if not misses:
+            return vectors
+        fresh = super().embed_documents([texts[i] for i in misses.values()], task_type=task_type,
+                                        **self._miss_kwargs(kwargs, misses))
+        return self._stitch(keys, vectors, misses, fresh)
+
+    async def aembed_documents(self, texts: List[str], task_type: Optional[str] = None, **kwargs) -> List[List[float]]:
+        keys, vectors, misses = await asyncio.to_thread(self._split_documents, texts, task_type, kwargs)
+        if not misses:
+            return vectors
+        fresh = await super().aembed_documents([texts[i] for i in misses.values()], task_type=task_type,
+                                               **self._miss_kwargs(kwargs, misses))
+        return await asyncio.to_thread(self._stitch, keys, vectors, misses, fresh)
+
+    async def aembed_documents_uncached(self, texts: List[str], task_type: Optional[str] = None,
+                                        **kwargs) -> List[List[float]]:
+        """Embed throwaway texts, such as context sentences, without filling either cache"""
+        return await super().aembed_documents(texts, task_type=task_type, **kwargs)
+
+_EMBED: Optional[CachedEmbeddings] = None
+
+def get_embeddings() -> CachedEmbeddings:
+    """Shared embeddings client, so its API connection is reused across calls"""
+    global _EMBED
+    if _EMBED is None:
+        _EMBED = CachedEmbeddings(model=EMBED_MODEL)
+    return _EMBED
+
+def _load_one(file_path: str) -> List[Document]:
+    if file_path.endswith('.pdf'):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith('.docx'):
+        loader = Docx2txtLoader(file_path)
+    else:
+        print(f"Unsupported file type: {os.path.basename(file_path)}")
+        return []
+    return loader.load()
 
 def load_documents(folder_path: str) -> List[Document]:
-    documents = []
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if filename.endswith('.pdf'):
-            loader = PyPDFLoader(file_path)
-        elif filename.endswith('.docx'):
-            loader = Docx2txtLoader(file_path)
-        else:
-            print(f"Unsupported file type: {filename}")
-            continue
-        documents.extend(loader.load())
-    return documents
+    """Load all supported files, parsing them in parallel worker processes"""
+    file_paths = [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path))]
+    if len(file_paths) <= 1:
+        return list(chain.from_iterable(map(_load_one, file_paths)))
+    # Spawned, not forked: the server calls this from a worker thread, and forking a threaded process can deadlock
+    with ProcessPoolExecutor(max_workers=min(len(file_paths), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("spawn")) as ex:
+        return list(chain.from_iterable(ex.map(_load_one, file_paths)))
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """Split documents into chunks in-process; pure-Python splitting is cheaper than pickling to workers"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len
+    )
+    return text_splitter.split_documents(documents)
+
+def embed_in_batches(embeddings: CachedEmbeddings, texts: List[str]) -> List[List[float]]:
+    """Embed texts in EMBED_BATCH_SIZE requests, at most EMBED_CONCURRENCY in flight"""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as ex:
+        results = ex.map(lambda batch: embeddings.embed_documents(batch, batch_size=EMBED_BATCH_SIZE), batches)
+        return list(chain.from_iterable(results))
 
 def create_vector_store():
     if not os.path.exists(SOURCE_DIR):
@@ -39,34 +202,56 @@ def create_vector_store():
         print("No documents found to index.")
         return None
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_documents(documents)
+    chunks = split_documents(documents)
+    if not chunks:
+        print("No text found to index.")
+        return None
     
-    embeddings = GoogleGenerativeAIEmbeddings(model=EMBED_MODEL)
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=str(INDEX_DIR),
-        collection_name=COLLECTION,
+    embeddings = get_embeddings()
+    texts = [c.page_content for c in chunks]
+    vectors = embed_in_batches(embeddings, texts)
+
+    # Vectors are L2-normalised, so inner-product scores are cosine similarities;
+    # the 8-bit scalar quantizer stores each dimension in one byte instead of four
+    matrix = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(matrix)
+    index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(matrix)
+    vectordb = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
     )
-    vectordb.persist()
+    vectordb.add_embeddings(zip(texts, matrix.tolist()), metadatas=[c.metadata for c in chunks])
+    vectordb.save_local(str(INDEX_DIR))
     print("Index built at", INDEX_DIR.resolve())
     return vectordb
 
+_retriever_lock = threading.Lock()
+
 def get_retriever():
-    if not INDEX_DIR.exists():
-        vectordb = create_vector_store()
-    else:
-        embeddings = GoogleGenerativeAIEmbeddings(model=EMBED_MODEL)
-        vectordb = Chroma(
-            persist_directory=str(INDEX_DIR),
-            embedding_function=embeddings,
-            collection_name=COLLECTION
+    """Load (or build) the index once; concurrent first callers wait for a single build"""
+    with _retriever_lock:
+        return _load_retriever()
+
+@functools.lru_cache(maxsize=1)
+def _load_retriever():
+    vectordb = None
+    if INDEX_DIR.exists():
+        embeddings = get_embeddings()
+        vectordb = FAISS.load_local(
+            str(INDEX_DIR),
+            embeddings,
+            allow_dangerous_deserialization=True,  # index files are written by create_vector_store
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
         )
+        vectordb.index.hnsw.efSearch = HNSW_EF_SEARCH
+    # Indexes saved with the earlier L2 metric are rebuilt (embeddings come from the cache)
+    if vectordb is None or vectordb.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        vectordb = create_vector_store()
     if vectordb:
-        return vectordb.as_retriever(search_kwargs={"k": 2})
+        return vectordb.as_retriever(search_type="mmr", search_kwargs=MMR_SEARCH_KWARGS)
     return None
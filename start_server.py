@@ -4,6 +4,12 @@ Startup script for the Gemini RAG Agent server
 """
 import uvicorn
 
+try:
+    import uvloop  # noqa: F401
+    LOOP = "uvloop"
+except ImportError:  # uvloop is not available on Windows
+    LOOP = "asyncio"
+
 if __name__ == "__main__":
     print("Starting Gemini RAG Agent Server...")
     print("Server will be available at: http://localhost:2024")
@@ -15,5 +21,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=2024,
         reload=True,  # Enable auto-reload for development
+        loop=LOOP,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,32 @@
+import unittest
+import numpy as np
+from app.semantic_cache import SemanticCache, PCA_FIT_SIZE
+
+class SemanticCacheProjectionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_stored_queries_hit_after_projection_fit(self):
+        rng = np.random.default_rng(0)
+        # Anisotropic embeddings: a shared direction plus low-rank structure and noise
+        dims = 768
+        base = rng.normal(size=dims)
+        basis = rng.normal(size=(64, dims))
+        vectors = rng.normal(size=(PCA_FIT_SIZE + 50, 64)) @ basis * 0.3 + base + rng.normal(size=(PCA_FIT_SIZE + 50, dims)) * 0.6
+
+        cache = SemanticCache()
+        embeddings = [cache._normalize(v) for v in vectors]
+        for i, embedding in enumerate(embeddings[:PCA_FIT_SIZE]):
+            cache.store(embedding, f"q{i}", f"a{i}")
+        await cache._fit_task
+        self.assertIsNotNone(cache._codes)
+        for i, embedding in enumerate(embeddings[PCA_FIT_SIZE:], start=PCA_FIT_SIZE):
+            cache.store(embedding, f"q{i}", f"a{i}")
+
+        for i in range(0, len(embeddings), 50):
+            entry = cache.lookup(embeddings[i])
+            self.assertIsNotNone(entry)
+            self.assertEqual(entry.query, f"q{i}")
+
+        unseen = cache._normalize(rng.normal(size=dims))
+        self.assertIsNone(cache.lookup(unseen))
+
+if __name__ == "__main__":
+    unittest.main()